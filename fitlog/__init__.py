@@ -1,4 +1,7 @@
-from flask import Flask, render_template
+from functools import lru_cache
+from pathlib import Path
+
+from flask import Flask, has_request_context, render_template, request, url_for
 
 
 def create_app():
@@ -6,23 +9,33 @@ def create_app():
 
     #auslagern
     app.config["SECRET_KEY"] = "secret_key"
+    # Pfad einmal auflösen statt bei jeder Connection
+    app.config["DB_PATH"] = str(Path(app.instance_path) / "fitlog.db")
 
-    from .db import close_db, get_db
+    from .db import close_db, enable_wal
+    from .blueprints.plans import list_active_plans
     app.teardown_appcontext(close_db)
+    enable_wal(app.config["DB_PATH"])
+
+    # URL-Map ist nach dem Start statisch -> url_for in Templates cachen.
+    # Das Ergebnis hängt noch vom Mount-Pfad (SCRIPT_NAME, z. B. hinter einem
+    # Reverse-Proxy) und bei _external von Schema/Host ab -> beides im Cache-Key.
+    @lru_cache(maxsize=4096)
+    def _url_for(script_root, host_url, endpoint, **values):
+        return url_for(endpoint, **values)
+
+    def cached_url_for(endpoint, **values):
+        if not has_request_context():
+            return url_for(endpoint, **values)
+        host_url = request.host_url if values.get("_external") else None
+        return _url_for(request.script_root, host_url, endpoint, **values)
+
+    app.jinja_env.globals["url_for"] = cached_url_for
 
     @app.get("/")
     def index():
-        db = get_db()
-
         # Nur aktive Pläne anzeigen
-        plans = db.execute(
-            """
-            SELECT id, name
-            FROM training_plans
-            WHERE deleted_at IS NULL
-            ORDER BY name
-            """
-        ).fetchall()
+        plans = list_active_plans()
 
         return render_template("index.html", plans=plans)
 
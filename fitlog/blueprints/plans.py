@@ -1,22 +1,23 @@
 from __future__ import annotations
 
 import sqlite3
-from datetime import datetime, timezone
+import time
+from itertools import repeat
+from typing import List
 
-from flask import Blueprint, abort, flash, jsonify, redirect, render_template, request, url_for
+from flask import Blueprint, abort, current_app, flash, jsonify, redirect, render_template, request, url_for
 
 from ..db import get_db
 
 bp = Blueprint("plans", __name__, url_prefix="/plans")
 
+# Startseiten-Liste der aktiven Pläne: kurz gecacht, bei Änderungen invalidiert
+_ACTIVE_PLANS_KEY = "fitlog.active_plans"
+_ACTIVE_PLANS_TTL = 30.0
+
 
 def _utcnow_iso() -> str:
-    return (
-        datetime.now(timezone.utc)
-        .replace(microsecond=0)
-        .replace(tzinfo=None)
-        .isoformat(timespec="seconds")
-    )
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
 
 
 def _load_active_plan(db: sqlite3.Connection, plan_id: int) -> sqlite3.Row:
@@ -29,6 +30,29 @@ def _load_active_plan(db: sqlite3.Connection, plan_id: int) -> sqlite3.Row:
     return plan
 
 
+def list_active_plans() -> List[sqlite3.Row]:
+    """Aktive Pläne (id, name) für die Startseite, bis zu _ACTIVE_PLANS_TTL Sekunden gecacht."""
+    cached = current_app.extensions.get(_ACTIVE_PLANS_KEY)
+    now = time.monotonic()
+    if cached and cached[0] > now:
+        return cached[1]
+
+    plans = get_db().execute(
+        """
+        SELECT id, name
+        FROM training_plans
+        WHERE deleted_at IS NULL
+        ORDER BY name
+        """
+    ).fetchall()
+    current_app.extensions[_ACTIVE_PLANS_KEY] = (now + _ACTIVE_PLANS_TTL, plans)
+    return plans
+
+
+def _invalidate_active_plans() -> None:
+    current_app.extensions.pop(_ACTIVE_PLANS_KEY, None)
+
+
 @bp.post("/create")
 def create_plan():
     name = (request.form.get("name") or "").strip()
@@ -42,6 +66,7 @@ def create_plan():
     try:
         db.execute("INSERT INTO training_plans (name) VALUES (?)", (name,))
         db.commit()
+        _invalidate_active_plans()
         flash(f"Plan „{name}“ erstellt.", "success")
     except sqlite3.IntegrityError:
         db.rollback()
@@ -98,25 +123,28 @@ def update_plan(plan_id: int):
     notes_ = request.form.getlist("note[]")
 
     try:
+        # Write-Lock sofort holen statt mitten in der Transaktion hochzustufen
+        db.execute("BEGIN IMMEDIATE")
         db.execute("UPDATE training_plans SET name = ? WHERE id = ?", (name, plan_id))
 
-        n = min(len(ex_ids), len(positions), len(sets_), len(reps_), len(weights_), len(notes_))
-        for i in range(n):
-            db.execute(
-                """
-                UPDATE plan_exercises
-                   SET position = ?,
-                       default_sets = ?,
-                       default_reps = ?,
-                       default_weight_kg = ?,
-                       note = ?
-                 WHERE plan_id = ?
-                   AND exercise_id = ?
-                """,
-                (positions[i], sets_[i], reps_[i], weights_[i], notes_[i], plan_id, ex_ids[i]),
-            )
+        # zip() kürzt auf die kürzeste Liste, wie zuvor min(len(...))
+        rows = zip(positions, sets_, reps_, weights_, notes_, repeat(plan_id), ex_ids)
+        db.executemany(
+            """
+            UPDATE plan_exercises
+               SET position = ?,
+                   default_sets = ?,
+                   default_reps = ?,
+                   default_weight_kg = ?,
+                   note = ?
+             WHERE plan_id = ?
+               AND exercise_id = ?
+            """,
+            rows,
+        )
 
         db.commit()
+        _invalidate_active_plans()
         flash("Plan gespeichert.", "success")
         return redirect(url_for("index"))
 
@@ -136,21 +164,24 @@ def add_exercise(plan_id: int):
         flash("Bitte eine Übung auswählen.", "error")
         return redirect(url_for("plans.edit_plan", plan_id=plan_id))
 
-    exists = db.execute("SELECT 1 FROM exercises WHERE id = ?", (exercise_id,)).fetchone()
-    if not exists:
-        flash("Übung nicht gefunden.", "error")
-        return redirect(url_for("plans.edit_plan", plan_id=plan_id))
-
-    next_pos = db.execute(
-        "SELECT COALESCE(MAX(position), 0) + 1 FROM plan_exercises WHERE plan_id = ?",
-        (plan_id,),
-    ).fetchone()[0]
-
+    # Existenzprüfung der Übung und nächste Position in einem Statement:
+    # rowcount 0 -> Übung existiert nicht, IntegrityError -> bereits im Plan
     try:
-        db.execute(
-            "INSERT INTO plan_exercises (plan_id, exercise_id, position) VALUES (?, ?, ?)",
-            (plan_id, exercise_id, next_pos),
+        cur = db.execute(
+            """
+            INSERT INTO plan_exercises (plan_id, exercise_id, position)
+            SELECT ?, e.id, COALESCE(
+                       (SELECT MAX(position) FROM plan_exercises WHERE plan_id = ?), 0
+                   ) + 1
+              FROM exercises e
+             WHERE e.id = ?
+            """,
+            (plan_id, plan_id, exercise_id),
         )
+        if cur.rowcount == 0:
+            db.rollback()
+            flash("Übung nicht gefunden.", "error")
+            return redirect(url_for("plans.edit_plan", plan_id=plan_id))
         db.commit()
         flash("Übung zum Plan hinzugefügt.", "success")
     except sqlite3.IntegrityError:
@@ -163,13 +194,18 @@ def add_exercise(plan_id: int):
 @bp.post("/<int:plan_id>/remove-exercise")
 def remove_exercise(plan_id: int):
     db = get_db()
-    exercise_id = request.form.get("exercise_id", type=int)
-    if not exercise_id:
+    # Mehrere Übungen auf einmal (exercise_id[]) oder eine einzelne (exercise_id)
+    ex_ids = [x for x in request.form.getlist("exercise_id[]", type=int) if x]
+    if not ex_ids:
+        single = request.form.get("exercise_id", type=int)
+        ex_ids = [single] if single else []
+    if not ex_ids:
         return jsonify({"ok": False, "msg": "exercise_id fehlt"}), 400
 
+    placeholders = ",".join("?" * len(ex_ids))
     db.execute(
-        "DELETE FROM plan_exercises WHERE plan_id = ? AND exercise_id = ?",
-        (plan_id, exercise_id),
+        f"DELETE FROM plan_exercises WHERE plan_id = ? AND exercise_id IN ({placeholders})",
+        (plan_id, *ex_ids),
     )
     db.commit()
     return jsonify({"ok": True})
@@ -193,4 +229,5 @@ def delete_plan(plan_id: int):
         (_utcnow_iso(), plan_id),
     )
     db.commit()
+    _invalidate_active_plans()
     return jsonify({"ok": True, "msg": f"Plan „{plan['name']}“ archiviert."})
@@ -1,20 +1,69 @@
 from __future__ import annotations
 
+import hashlib
 import io
-from datetime import datetime
-from typing import List, Optional, Tuple
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 
-import matplotlib
-
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt  # noqa: E402
-
-from flask import Blueprint, Response, abort, render_template, request, url_for
+from flask import (
+    Blueprint, Response, abort, current_app, make_response, render_template, request, send_file, url_for,
+)
 
 from ..db import get_db
 
 progress_bp = Blueprint("progress", __name__, url_prefix="/progress")
 
+# Anzahl gerenderter Diagramme, die pro Worker im Speicher gehalten werden
+_PNG_CACHE_SIZE = 64
+# zlib-Stufe für die PNG-Kodierung (Pillow-Default 6)
+_PNG_COMPRESS_LEVEL = 3
+
+# Je Diagrammtyp eine wiederverwendete Figure; Canvas/Fonts werden nur einmal
+# aufgebaut. Das Lock je Typ schützt diese geteilte Figure/Axes (eine Figure darf
+# nicht von zwei Threads gleichzeitig bearbeitet werden); Plan- und
+# Übungsdiagramm können parallel rendern.
+# matplotlib selbst wird erst beim ersten Diagramm importiert (schnellerer Worker-Start).
+_CHART_FIGSIZES = {"plan": (7.5, 3.8), "exercise": (7.5, 3.2)}
+# Bildschirmauflösung; Exporte dürfen per ?dpi= bis _MAX_DOWNLOAD_DPI anfordern
+_CHART_DPI = 100
+_MIN_DOWNLOAD_DPI = 72
+_MAX_DOWNLOAD_DPI = 200
+# Geht in die ETags der PNG-Routen ein: bei Änderungen an Diagramm-Code oder
+# -Styling erhöhen, damit Browser zwischengespeicherte Bilder neu laden
+_CHART_RENDER_VERSION = 1
+_CHART_LOCKS = {kind: threading.Lock() for kind in _CHART_FIGSIZES}
+_charts: Dict[str, Tuple[Any, Any]] = {}
+_SUBPLOT_PARAMS = ("left", "right", "bottom", "top", "wspace", "hspace")
+
+
+def _chart(kind: str) -> Tuple[Any, Any]:
+    """Liefert (fig, ax) für den Diagrammtyp; Aufrufer hält _CHART_LOCKS[kind]."""
+    if kind not in _charts:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=_CHART_FIGSIZES[kind], dpi=_CHART_DPI)
+        FigureCanvasAgg(fig)
+        _charts[kind] = (fig, fig.add_subplot())
+    return _charts[kind]
+
+
+def _reset_chart(kind: str, dpi: int) -> Tuple[Any, Any]:
+    """
+    Wie _chart, aber mit zurückgesetztem Zustand: ax.clear() lässt die
+    Subplot-Ränder stehen, von denen tight_layout sonst ausgeht – ohne Reset
+    hinge das PNG davon ab, welches Diagramm vorher gerendert wurde.
+    """
+    import matplotlib as mpl
+
+    fig, ax = _chart(kind)
+    fig.set_dpi(dpi)
+    fig.subplots_adjust(**{k: mpl.rcParams[f"figure.subplot.{k}"] for k in _SUBPLOT_PARAMS})
+    ax.clear()
+    return fig, ax
+
 
 def _fetch_plan_name(plan_id: int) -> Optional[str]:
     db = get_db()
@@ -31,6 +80,13 @@ def _fetch_exercise_name(exercise_id: int) -> Optional[str]:
     return row["name"] if row else None
 
 
+def _fetch_tuples(db: sqlite3.Connection, sql: str, params: Tuple[Any, ...]) -> List[Tuple[Any, ...]]:
+    """Wie execute().fetchall(), aber mit einfachen Tupeln statt sqlite3.Row."""
+    cur = db.execute(sql, params)
+    cur.row_factory = None
+    return cur.fetchall()
+
+
 def _fetch_plan_exercises_with_latest_weight(plan_id: int) -> List[Tuple[str, float]]:
     """
     Liefert Liste von (exercise_name, latest_weight_kg) für alle Übungen eines Plans.
@@ -38,101 +94,246 @@ def _fetch_plan_exercises_with_latest_weight(plan_id: int) -> List[Tuple[str, fl
     """
     db = get_db()
 
-    plan_rows = db.execute(
+    rows = _fetch_tuples(
+        db,
         """
+        WITH latest AS (
+            SELECT
+                se.exercise_id,
+                se.weight_kg,
+                ROW_NUMBER() OVER (
+                    PARTITION BY se.exercise_id
+                    ORDER BY COALESCE(se.created_at, s.ended_at, s.started_at) DESC
+                ) AS rn
+            FROM session_entries se
+            JOIN sessions s ON s.id = se.session_id
+            WHERE s.plan_id = ?
+              AND se.weight_kg IS NOT NULL
+        )
         SELECT
-            e.id   AS exercise_id,
             e.name AS exercise_name,
-            COALESCE(pe.default_weight_kg, 0) AS default_weight_kg
+            COALESCE(l.weight_kg, pe.default_weight_kg, 0) AS weight_kg
         FROM plan_exercises pe
         JOIN exercises e ON e.id = pe.exercise_id
+        LEFT JOIN latest l ON l.exercise_id = pe.exercise_id AND l.rn = 1
         WHERE pe.plan_id = ?
         ORDER BY COALESCE(pe.position, 999999), e.name COLLATE NOCASE
         """,
-        (plan_id,),
-    ).fetchall()
+        (plan_id, plan_id),
+    )
 
-    result: List[Tuple[str, float]] = []
-    for r in plan_rows:
-        ex_id = r["exercise_id"]
-        ex_name = r["exercise_name"]
-        default_weight = float(r["default_weight_kg"] or 0)
+    return [(name, float(weight)) for name, weight in rows]
 
-        rec = db.execute(
-            """
-            SELECT se.weight_kg
-            FROM session_entries se
-            JOIN sessions s ON s.id = se.session_id
-            WHERE s.plan_id = ?
-              AND se.exercise_id = ?
-              AND se.weight_kg IS NOT NULL
-            ORDER BY COALESCE(se.created_at, s.ended_at, s.started_at) DESC
-            LIMIT 1
-            """,
-            (plan_id, ex_id),
-        ).fetchone()
 
-        latest = float(rec["weight_kg"]) if rec and rec["weight_kg"] is not None else default_weight
-        result.append((ex_name, latest))
+# Tagesaggregat der Historie einer Übung (höchstes Gewicht pro Tag)
+_DAILY_HISTORY_SQL = """
+    SELECT
+        DATE(COALESCE(se.created_at, s.ended_at, s.started_at)) AS day,
+        MAX(se.weight_kg) AS weight_kg
+    FROM session_entries se
+    JOIN sessions s ON s.id = se.session_id
+    WHERE se.exercise_id = ?
+      AND se.weight_kg IS NOT NULL
+    GROUP BY day
+"""
 
-    return result
+# Ab so vielen Trainingstagen wird auf einen Punkt pro Woche verdichtet
+_MAX_DAILY_POINTS = 365
 
 
 def _fetch_exercise_history(exercise_id: int) -> List[Tuple[str, float]]:
     """
     Historie einer Übung abrufen: Liste von (YYYY-MM-DD, weight_kg).
+    Pro Tag ein Punkt (höchstes Gewicht), bei langen Historien pro Woche;
+    aggregiert bereits in SQL.
     """
     db = get_db()
-    rows = db.execute(
-        """
-        SELECT
-            DATE(COALESCE(se.created_at, s.ended_at, s.started_at)) AS day,
-            se.weight_kg
-        FROM session_entries se
-        JOIN sessions s ON s.id = se.session_id
-        WHERE se.exercise_id = ?
-        ORDER BY COALESCE(se.created_at, s.ended_at, s.started_at)
+    # Anzahl der Tage per Fensterfunktion: Tages- oder Wochengruppierung wird
+    # in derselben Abfrage entschieden. Wochen laufen von Montag bis Sonntag
+    # (ISO); ein Wochenpunkt liegt auf dem Montag der Woche.
+    rows = _fetch_tuples(
+        db,
+        f"""
+        WITH daily AS ({_DAILY_HISTORY_SQL}),
+        bucketed AS (
+            SELECT
+                CASE
+                    WHEN COUNT(*) OVER () > ? THEN date(day, 'weekday 0', '-6 days')
+                    ELSE day
+                END AS bucket,
+                weight_kg
+            FROM daily
+        )
+        SELECT bucket AS day, MAX(weight_kg) AS weight_kg
+        FROM bucketed
+        GROUP BY bucket
+        ORDER BY bucket
         """,
-        (exercise_id,),
-    ).fetchall()
+        (exercise_id, _MAX_DAILY_POINTS),
+    )
+
+    return [(day, float(weight)) for day, weight in rows]
 
-    history: List[Tuple[str, float]] = []
-    for r in rows:
-        if r["weight_kg"] is None:
-            continue
-        history.append((r["day"], float(r["weight_kg"])))
-    return history
 
+def _fig_to_png(fig) -> bytes:
+    """
+    Rastert die Figure mit Agg und kodiert per Pillow mit niedriger zlib-Stufe –
+    für Diagramme mit großen Flächen kaum größer, aber deutlich schneller als savefig.
+    """
+    from PIL import Image
+
+    fig.canvas.draw()
+    width, height = fig.canvas.get_width_height()
+    img = Image.frombuffer("RGBA", (width, height), fig.canvas.buffer_rgba(), "raw", "RGBA", 0, 1)
 
-def _png_response(fig, download_filename: Optional[str] = None) -> Response:
     buf = io.BytesIO()
-    fig.savefig(buf, format="png")
-    plt.close(fig)
-    buf.seek(0)
+    img.save(buf, format="PNG", compress_level=_PNG_COMPRESS_LEVEL)
+    return buf.getvalue()
+
+
+@lru_cache(maxsize=_PNG_CACHE_SIZE)
+def _render_plan_png(plan_name: str, data: Tuple[Tuple[str, float], ...], dpi: int) -> bytes:
+    """
+    Rendert das Balkendiagramm eines Plans.
+    Gecacht über Name + Daten: solange sich nichts ändert, kein matplotlib-Aufruf.
+    """
+    labels = [name for name, _ in data]
+    values = [val for _, val in data]
+
+    with _CHART_LOCKS["plan"]:
+        fig, ax = _reset_chart("plan", dpi)
+
+        if values:
+            ax.bar(labels, values)
+            for label in ax.get_xticklabels():
+                label.set_rotation(18)
+                label.set_horizontalalignment("right")
+        else:
+            ax.text(0.5, 0.5, "Keine Übungen im Plan.", ha="center", va="center", transform=ax.transAxes)
+
+        ax.set_title(f"Aktuelles Gewicht pro Übung – {plan_name}")
+        ax.set_ylabel("Gewicht (kg)")
+        ax.set_xlabel("Übung")
+        ax.grid(axis="y", linestyle=":", alpha=0.4)
+        fig.tight_layout()
+
+        return _fig_to_png(fig)
+
+
+@lru_cache(maxsize=_PNG_CACHE_SIZE)
+def _render_exercise_png(
+    exercise_name: str, history: Tuple[Tuple[str, float], ...], dpi: int
+) -> bytes:
+    """
+    Rendert den Gewichtsverlauf einer Übung.
+    Gecacht über Name + Historie: solange sich nichts ändert, kein matplotlib-Aufruf.
+    """
+    import numpy as np
+
+    # Eine vektorisierte Umwandlung statt strptime pro Zeile
+    dates = np.array([day for day, _ in history], dtype="datetime64[D]")
+    weights = np.fromiter((w for _, w in history), dtype=np.float64, count=len(history))
+
+    with _CHART_LOCKS["exercise"]:
+        fig, ax = _reset_chart("exercise", dpi)
+
+        if weights.size:
+            ax.plot(dates, weights, marker="o", linewidth=2)
+        else:
+            ax.text(0.5, 0.5, "Noch keine Daten.", ha="center", va="center", transform=ax.transAxes)
+
+        ax.set_title(f"Gewicht über Zeit – {exercise_name}")
+        ax.set_ylabel("Gewicht (kg)")
+        ax.set_xlabel("Datum")
+        ax.grid(True, linestyle=":", alpha=0.4)
+        fig.autofmt_xdate()
+        fig.tight_layout()
+
+        return _fig_to_png(fig)
+
+
+def _etag(*parts: Any) -> str:
+    """ETag aus den Daten, von denen eine Antwort abhängt."""
+    return hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+
+
+# Templates der Übersichtsseite; ihr Inhalt geht in deren ETag ein
+_OVERVIEW_TEMPLATES = ("base.html", "progress_plan.html")
+
+
+def _read_template_version() -> str:
+    env = current_app.jinja_env
+    sources = [env.loader.get_source(env, name)[0] for name in _OVERVIEW_TEMPLATES]
+    return _etag(*sources)
+
+
+_cached_template_version = lru_cache(maxsize=1)(_read_template_version)
+
+
+def _template_version() -> str:
+    """Hash der Seiten-Templates; bei automatischem Neuladen (Debug) jedes Mal neu gelesen."""
+    if current_app.jinja_env.auto_reload:
+        return _read_template_version()
+    return _cached_template_version()
+
 
-    headers = {}
-    if download_filename:
-        safe = download_filename.replace('"', "'")
-        headers["Content-Disposition"] = f'attachment; filename="{safe}"'
+def _not_modified(etag: str, weak: bool = False) -> Response:
+    response = Response(status=304)
+    response.set_etag(etag, weak=weak)
+    return response
 
-    return Response(buf.getvalue(), mimetype="image/png", headers=headers)
+
+def _requested_dpi(download: bool) -> int:
+    """Auflösung des Diagramms: fest für die Anzeige, wählbar (begrenzt) beim Export."""
+    if not download:
+        return _CHART_DPI
+    dpi = request.args.get("dpi", _CHART_DPI, type=int)
+    return min(max(dpi, _MIN_DOWNLOAD_DPI), _MAX_DOWNLOAD_DPI)
+
+
+def _png_response(png: bytes, etag: str, download_filename: Optional[str] = None) -> Response:
+    # send_file setzt Content-Disposition (inkl. Umlaute als filename*) selbst.
+    # Schwaches ETag und keine Range-Unterstützung: das ETag beschreibt die
+    # Daten des Diagramms, nicht garantiert byte-identische PNGs (andere
+    # Worker/matplotlib-Versionen) – Teilantworten dürfen nicht gemischt werden.
+    # If-None-Match prüfen die Routen selbst, bevor gerendert wird.
+    response = send_file(
+        io.BytesIO(png),
+        mimetype="image/png",
+        as_attachment=download_filename is not None,
+        download_name=download_filename,
+        etag=False,
+        conditional=False,
+        max_age=0,
+    )
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    response.cache_control.must_revalidate = True
+    return response
 
 
 @progress_bp.get("/")
 def overview():
     db = get_db()
 
-    plans = db.execute(
-        "SELECT id, name FROM training_plans WHERE deleted_at IS NULL ORDER BY name COLLATE NOCASE"
-    ).fetchall()
-    exercises = db.execute(
-        "SELECT id, name FROM exercises ORDER BY name COLLATE NOCASE"
-    ).fetchall()
-
     diagram_type = request.args.get("diagram_type", "plan")
     if diagram_type not in ("plan", "exercise"):
         diagram_type = "plan"
 
+    # Nur die Liste des aktiven Diagrammtyps laden; die andere Auswahl ist
+    # ausgeblendet und ein Wechsel lädt die Seite ohnehin neu
+    plans: List[Any] = []
+    exercises: List[Any] = []
+    if diagram_type == "plan":
+        plans = db.execute(
+            "SELECT id, name FROM training_plans WHERE deleted_at IS NULL ORDER BY name COLLATE NOCASE"
+        ).fetchall()
+    else:
+        exercises = db.execute(
+            "SELECT id, name FROM exercises ORDER BY name COLLATE NOCASE"
+        ).fetchall()
+
     selected_plan_id = request.args.get("plan_id", type=int)
     selected_exercise_id = request.args.get("exercise_id", type=int)
 
@@ -157,7 +358,20 @@ def overview():
         else:
             selected_exercise_id = None
 
-    return render_template(
+    # Seite hängt nur von Templates, Auswahl + Plan-/Übungslisten ab -> ETag daraus;
+    # bei passendem If-None-Match wird gar nicht erst gerendert
+    etag = _etag(
+        _template_version(),
+        diagram_type,
+        selected_plan_id,
+        selected_exercise_id,
+        [tuple(p) for p in plans],
+        [tuple(e) for e in exercises],
+    )
+    if etag in request.if_none_match:
+        return _not_modified(etag)
+
+    html = render_template(
         "progress_plan.html",
         diagram_type=diagram_type,
         plans=plans,
@@ -169,6 +383,9 @@ def overview():
         image_url=image_url,
         title_suffix=title_suffix,
     )
+    response = make_response(html)
+    response.set_etag(etag)
+    return response
 
 
 @progress_bp.get("/plan/<int:plan_id>/png")
@@ -177,27 +394,18 @@ def plan_png(plan_id: int):
     if not plan_name:
         abort(404, "Plan nicht gefunden!")
 
-    data = _fetch_plan_exercises_with_latest_weight(plan_id)
-    labels = [name for name, _ in data]
-    values = [val for _, val in data]
+    download = request.args.get("download", type=int) == 1
+    dpi = _requested_dpi(download)
 
-    fig, ax = plt.subplots(figsize=(7.5, 3.8), dpi=140)
+    data = tuple(_fetch_plan_exercises_with_latest_weight(plan_id))
+    etag = _etag("plan", _CHART_RENDER_VERSION, plan_name, data, dpi)
+    if request.if_none_match.contains_weak(etag):
+        return _not_modified(etag, weak=True)
 
-    if values:
-        ax.bar(labels, values)
-        plt.setp(ax.get_xticklabels(), rotation=18, ha="right")
-    else:
-        ax.text(0.5, 0.5, "Keine Übungen im Plan.", ha="center", va="center", transform=ax.transAxes)
+    png = _render_plan_png(plan_name, data, dpi)
 
-    ax.set_title(f"Aktuelles Gewicht pro Übung – {plan_name}")
-    ax.set_ylabel("Gewicht (kg)")
-    ax.set_xlabel("Übung")
-    ax.grid(axis="y", linestyle=":", alpha=0.4)
-    plt.tight_layout()
-
-    download = request.args.get("download", type=int) == 1
     filename = f"progress_plan_{plan_name}.png" if download else None
-    return _png_response(fig, filename)
+    return _png_response(png, etag, filename)
 
 
 @progress_bp.get("/exercise/<int:exercise_id>/png")
@@ -206,24 +414,15 @@ def exercise_png(exercise_id: int):
     if not exercise_name:
         abort(404, "Übung nicht gefunden!")
 
-    history = _fetch_exercise_history(exercise_id)
-    dates = [datetime.strptime(day, "%Y-%m-%d").date() for day, _ in history]
-    weights = [w for _, w in history]
-
-    fig, ax = plt.subplots(figsize=(7.5, 3.2), dpi=140)
+    download = request.args.get("download", type=int) == 1
+    dpi = _requested_dpi(download)
 
-    if weights:
-        ax.plot(dates, weights, marker="o", linewidth=2)
-    else:
-        ax.text(0.5, 0.5, "Noch keine Daten.", ha="center", va="center", transform=ax.transAxes)
+    history = tuple(_fetch_exercise_history(exercise_id))
+    etag = _etag("exercise", _CHART_RENDER_VERSION, exercise_name, history, dpi)
+    if request.if_none_match.contains_weak(etag):
+        return _not_modified(etag, weak=True)
 
-    ax.set_title(f"Gewicht über Zeit – {exercise_name}")
-    ax.set_ylabel("Gewicht (kg)")
-    ax.set_xlabel("Datum")
-    ax.grid(True, linestyle=":", alpha=0.4)
-    fig.autofmt_xdate()
-    plt.tight_layout()
+    png = _render_exercise_png(exercise_name, history, dpi)
 
-    download = request.args.get("download", type=int) == 1
     filename = f"progress_exercise_{exercise_name}.png" if download else None
-    return _png_response(fig, filename)
+    return _png_response(png, etag, filename)
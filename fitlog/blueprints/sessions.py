@@ -1,24 +1,30 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta, timezone
+from collections import defaultdict
 from typing import Any, Dict, List, Optional
+import math
+import re
 import sqlite3
+import time
 
 from flask import Blueprint, render_template, request, redirect, url_for, abort, flash
+from werkzeug.datastructures import MultiDict
 
 from ..db import get_db
 
 bp = Blueprint("sessions", __name__, url_prefix="/sessions")
 
+# Formularfelder der Erfassungsmaske: ex[<exercise_id>][<feld>] (nur bekannte Felder)
+_EX_FIELD_RE = re.compile(r"^ex\[(\d+)\]\[(sets|reps|weight|note)\]$")
+
+# Obergrenze für eine angegebene Trainingsdauer; größere/ungültige Werte werden
+# ignoriert (strftime würde außerhalb des Datumsbereichs NULL liefern)
+_MAX_DURATION_MINUTES = 24 * 60
+
 
 def _utcnow_iso() -> str:
     """UTC timestamp ISO (seconds), timezone-naiv gespeichert."""
-    return (
-        datetime.now(timezone.utc)
-        .replace(microsecond=0)
-        .replace(tzinfo=None)
-        .isoformat(timespec="seconds")
-    )
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
 
 
 def _load_session(db: sqlite3.Connection, session_id: int) -> sqlite3.Row:
@@ -43,33 +49,124 @@ def _load_session(db: sqlite3.Connection, session_id: int) -> sqlite3.Row:
     return row
 
 
-def _load_record_items(db: sqlite3.Connection, session_id: int) -> List[sqlite3.Row]:
+def _session_exists(db: sqlite3.Connection, session_id: int) -> bool:
+    """Reine Existenzprüfung ohne Join (für Routen, die nur schreiben)."""
+    return db.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is not None
+
+
+def _coalesce(*values: Any) -> Any:
+    """Erster Wert, der nicht None ist (wie SQL COALESCE)."""
+    return next((v for v in values if v is not None), None)
+
+
+def _load_record_items(db: sqlite3.Connection, session_id: int) -> List[Dict[str, Any]]:
     """
     Eine Zeile je Übung im Plan, prefilled mit:
       - session_entries (falls vorhanden) sonst Plan-Defaults
       - Notiz wird nur angezeigt (session_entries.note > plan_exercises.note > '')
+    Plan-Übungen und Session-Einträge werden getrennt geladen und in Python
+    zusammengeführt (statt LEFT JOIN über vier Tabellen).
     """
-    return db.execute(
+    plan_rows = db.execute(
         """
         SELECT
             e.id   AS exercise_id,
             e.name AS name,
-            COALESCE(se.sets,      pe.default_sets,      3)  AS sets,
-            COALESCE(se.reps,      pe.default_reps,      10) AS reps,
-            COALESCE(se.weight_kg, pe.default_weight_kg, 0)  AS weight_kg,
-            COALESCE(se.note,      pe.note,             '') AS note
-        FROM sessions s
-        JOIN plan_exercises pe ON pe.plan_id = s.plan_id
-        JOIN exercises      e  ON e.id       = pe.exercise_id
-        LEFT JOIN session_entries se
-               ON se.session_id  = s.id
-              AND se.exercise_id = e.id
-        WHERE s.id = ?
+            pe.default_sets,
+            pe.default_reps,
+            pe.default_weight_kg,
+            pe.note
+        FROM plan_exercises pe
+        JOIN exercises e ON e.id = pe.exercise_id
+        WHERE pe.plan_id = (SELECT plan_id FROM sessions WHERE id = ?)
         ORDER BY COALESCE(pe.position, 999999), e.name COLLATE NOCASE
         """,
         (session_id,),
     ).fetchall()
 
+    entries = {
+        r["exercise_id"]: dict(r)
+        for r in db.execute(
+            """
+            SELECT exercise_id, sets, reps, weight_kg, note
+              FROM session_entries
+             WHERE session_id = ?
+            """,
+            (session_id,),
+        )
+    }
+
+    items: List[Dict[str, Any]] = []
+    for pe in plan_rows:
+        se = entries.get(pe["exercise_id"], {})
+        items.append(
+            {
+                "exercise_id": pe["exercise_id"],
+                "name": pe["name"],
+                "sets": _coalesce(se.get("sets"), pe["default_sets"], 3),
+                "reps": _coalesce(se.get("reps"), pe["default_reps"], 10),
+                "weight_kg": _coalesce(se.get("weight_kg"), pe["default_weight_kg"], 0),
+                "note": _coalesce(se.get("note"), pe["note"], ""),
+            }
+        )
+    return items
+
+
+# ------------------------------
+# Formular
+# ------------------------------
+def _to_int(s: str) -> Optional[int]:
+    if s == "":
+        return None
+    try:
+        return int(s)
+    except ValueError:
+        return None
+
+
+def _to_float(s: str) -> Optional[float]:
+    if s == "":
+        return None
+    try:
+        return float(s.replace(",", "."))
+    except ValueError:
+        return None
+
+
+def _parse_exercise_fields(form: MultiDict) -> Dict[int, Dict[str, str]]:
+    """Zerlegt alle ex[<id>][<feld>]-Inputs in einem Durchlauf: {id: {feld: wert}}."""
+    fields: Dict[int, Dict[str, str]] = defaultdict(dict)
+    for key, value in form.items():
+        m = _EX_FIELD_RE.match(key)
+        if m:
+            fields[int(m.group(1))][m.group(2)] = str(value or "").strip()
+    return fields
+
+
+def _collect_form(form: MultiDict) -> List[Dict[str, Any]]:
+    """
+    Liest die Erfassungsmaske einmal und liefert je Übung:
+      {exercise_id, sets, reps, weight, note} (Zahlen bereits konvertiert).
+    Erwartet Inputs wie: ex[<exercise_id>][weight|reps|sets|note]
+    IDs kommen aus hidden inputs: <input type="hidden" name="exercise_id" ...>
+    """
+    exercise_ids = [int(x) for x in form.getlist("exercise_id") if str(x).isdigit()]
+    fields = _parse_exercise_fields(form)
+
+    rows: List[Dict[str, Any]] = []
+    for ex_id in exercise_ids:
+        ex = fields.get(ex_id, {})
+        rows.append(
+            {
+                "exercise_id": ex_id,
+                "sets": _to_int(ex.get("sets", "")),
+                "reps": _to_int(ex.get("reps", "")),
+                "weight": _to_float(ex.get("weight", "")),
+                "note": ex.get("note", ""),
+            }
+        )
+    return rows
+
 
 # ------------------------------
 # Persist / Updates
@@ -81,113 +178,86 @@ def _update_plan_defaults_from_session(
     Für jede Übung mit positivem Gewicht in dieser Session:
     -> plan_exercises.default_weight_kg aktualisieren.
     """
-    rows = db.execute(
+    db.execute(
         """
-        SELECT exercise_id, weight_kg
-          FROM session_entries
-         WHERE session_id = ?
-           AND weight_kg IS NOT NULL
+        UPDATE plan_exercises
+           SET default_weight_kg = se.weight_kg
+          FROM session_entries se
+         WHERE se.session_id = ?
+           AND se.weight_kg IS NOT NULL
+           AND se.weight_kg > 0
+           AND plan_exercises.plan_id = ?
+           AND plan_exercises.exercise_id = se.exercise_id
         """,
-        (session_id,),
-    ).fetchall()
-
-    for row in rows:
-        ex_id = row["exercise_id"]
-        try:
-            w = float(row["weight_kg"])
-        except (TypeError, ValueError):
-            continue
-        if w <= 0:
-            continue
-
-        db.execute(
-            """
-            UPDATE plan_exercises
-               SET default_weight_kg = ?
-             WHERE plan_id = ?
-               AND exercise_id = ?
-            """,
-            (w, plan_id, ex_id),
-        )
-
-
-def _upsert_entries(db: sqlite3.Connection, session_id: int, form: Dict[str, Any]) -> None:
-    """
-    Erwartet Inputs wie: ex[<exercise_id>][weight|reps|sets]
-    IDs kommen aus hidden inputs: <input type="hidden" name="exercise_id" ...>
-    """
-
-    def get(key: str) -> str:
-        return str(form.get(key) or "").strip()
-
-    def to_int(s: str) -> Optional[int]:
-        if s == "":
-            return None
-        try:
-            return int(s)
-        except ValueError:
-            return None
-
-    def to_float(s: str) -> Optional[float]:
-        if s == "":
-            return None
-        try:
-            return float(s.replace(",", "."))
-        except ValueError:
-            return None
+        (session_id, plan_id),
+    )
 
-    exercise_ids = [int(x) for x in request.form.getlist("exercise_id") if str(x).isdigit()]
 
-    for ex_id in exercise_ids:
-        sets_val = to_int(get(f"ex[{ex_id}][sets]"))
-        reps = to_int(get(f"ex[{ex_id}][reps]"))
-        weight = to_float(get(f"ex[{ex_id}][weight]"))
-        note = get(f"ex[{ex_id}][note]")
+def _upsert_entries(
+    db: sqlite3.Connection, session_id: int, rows: List[Dict[str, Any]]
+) -> None:
+    """Schreibt die erfassten Werte (aus _collect_form) nach session_entries."""
+    now = _utcnow_iso()
 
+    delete_ids: List[int] = []
+    upsert_rows: List[tuple] = []
+    for row in rows:
         # "Übung ausgelassen": sets explizit 0 -> Eintrag entfernen (falls vorhanden)
-        if sets_val == 0:
-            db.execute(
-                "DELETE FROM session_entries WHERE session_id = ? AND exercise_id = ?",
-                (session_id, ex_id),
-            )
+        if row["sets"] == 0:
+            delete_ids.append(row["exercise_id"])
             continue
 
+        upsert_rows.append(
+            (session_id, row["exercise_id"], row["weight"], row["reps"], row["sets"], row["note"], now)
+        )
+
+    if delete_ids:
+        placeholders = ",".join("?" * len(delete_ids))
         db.execute(
-            """
-            INSERT INTO session_entries (session_id, exercise_id, weight_kg, reps, sets, note, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(session_id, exercise_id) DO UPDATE SET
-              weight_kg  = excluded.weight_kg,
-              reps       = excluded.reps,
-              sets       = excluded.sets,
-              note       = excluded.note,
-              created_at = excluded.created_at
-            """,
-            (session_id, ex_id, weight, reps, sets_val, note, _utcnow_iso()),
+            f"DELETE FROM session_entries WHERE session_id = ? AND exercise_id IN ({placeholders})",
+            (session_id, *delete_ids),
         )
 
+    db.executemany(
+        """
+        INSERT INTO session_entries (session_id, exercise_id, weight_kg, reps, sets, note, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(session_id, exercise_id) DO UPDATE SET
+          weight_kg  = excluded.weight_kg,
+          reps       = excluded.reps,
+          sets       = excluded.sets,
+          note       = excluded.note,
+          created_at = excluded.created_at
+        """,
+        upsert_rows,
+    )
+
 
 def _update_plan_notes_from_form(
-    db: sqlite3.Connection, plan_id: int, form: Dict[str, Any]
+    db: sqlite3.Connection, plan_id: int, rows: List[Dict[str, Any]]
 ) -> None:
     """Übernimmt Notizen aus dem Record-Formular dauerhaft in den Trainingsplan."""
+    if not rows:
+        return
 
-    def get(key: str) -> str:
-        return str(form.get(key) or "").strip()
-
-    exercise_ids = [int(x) for x in request.form.getlist("exercise_id") if str(x).isdigit()]
-
-    for ex_id in exercise_ids:
-        note = get(f"ex[{ex_id}][note]")
-        db.execute(
-            """
-            UPDATE plan_exercises
-               SET note = ?
-             WHERE plan_id = ?
-               AND exercise_id = ?
-            """,
-            (note, plan_id, ex_id),
-        )
+    # Ein UPDATE für alle Notizen: (exercise_id, note)-Paare als VALUES-Tabelle,
+    # geschrieben werden nur Zeilen, deren Notiz sich geändert hat
+    values = ", ".join(["(?, ?)"] * len(rows))
+    params: List[Any] = []
+    for row in rows:
+        params += (row["exercise_id"], row["note"])
+    db.execute(
+        f"""
+        WITH v(exercise_id, note) AS (VALUES {values})
+        UPDATE plan_exercises
+           SET note = v.note
+          FROM v
+         WHERE plan_exercises.plan_id = ?
+           AND plan_exercises.exercise_id = v.exercise_id
+           AND plan_exercises.note IS NOT v.note
+        """,
+        (*params, plan_id),
+    )
 
 
 # ------------------------------
@@ -202,19 +272,19 @@ def new_session():
     if plan_id is None:
         abort(400, description="plan_id is required")
 
-    plan = db.execute(
-        "SELECT id FROM training_plans WHERE id = ? AND deleted_at IS NULL",
-        (plan_id,),
-    ).fetchone()
-    if not plan:
+    # Existenzprüfung des (aktiven) Plans direkt im INSERT: keine Zeile -> 404
+    with db:
+        row = db.execute(
+            """
+            INSERT INTO sessions (plan_id, started_at)
+            SELECT id, ? FROM training_plans WHERE id = ? AND deleted_at IS NULL
+            RETURNING id
+            """,
+            (_utcnow_iso(), plan_id),
+        ).fetchone()
+    if not row:
         abort(404)
-
-    cur = db.execute(
-        "INSERT INTO sessions (plan_id, started_at) VALUES (?, ?)",
-        (plan_id, _utcnow_iso()),
-    )
-    session_id = cur.lastrowid
-    db.commit()
+    session_id = row["id"]
 
     return redirect(url_for("sessions.record_session", session_id=session_id))
 
@@ -232,10 +302,6 @@ def record_session(session_id: int):
 def finish_session(session_id: int):
     """Training speichern & beenden."""
     db = get_db()
-    sess = _load_session(db, session_id)
-
-    _upsert_entries(db, session_id, request.form)
-    _update_plan_notes_from_form(db, sess["plan_id"], request.form)
 
     raw_minutes = (request.form.get("duration_minutes") or "").strip()
     mins = 0.0
@@ -244,23 +310,42 @@ def finish_session(session_id: int):
             mins = max(0.0, float(raw_minutes.replace(",", ".")))
         except ValueError:
             mins = 0.0
+        if not math.isfinite(mins) or mins > _MAX_DURATION_MINUTES:
+            mins = 0.0
 
-    if mins > 0.0:
-        try:
-            start_dt = datetime.fromisoformat(sess["started_at"])
-        except Exception:
-            start_dt = datetime.utcnow()
-        ended_at_iso = (start_dt + timedelta(minutes=mins)).isoformat(timespec="seconds")
-        db.execute("UPDATE sessions SET ended_at = ? WHERE id = ?", (ended_at_iso, session_id))
-    else:
-        db.execute(
-            "UPDATE sessions SET ended_at = COALESCE(ended_at, ?) WHERE id = ?",
-            (_utcnow_iso(), session_id),
-        )
+    # Formular vor dem Write-Lock auswerten, in der Transaktion nur noch SQL
+    rows = _collect_form(request.form)
+
+    # Alle Schreibzugriffe in einer Transaktion, Write-Lock direkt zu Beginn;
+    # "with db" committet am Ende bzw. macht bei Fehlern (auch abort) Rollback.
+    # Das UPDATE auf sessions prüft gleichzeitig die Existenz (RETURNING).
+    # Angegebene Dauer hat Vorrang: Ende = Start + Dauer (Start unlesbar -> jetzt + Dauer),
+    # sonst bleibt ein bereits gesetztes Ende erhalten.
+    duration = f"+{mins:f} minutes"
+    with db:
+        db.execute("BEGIN IMMEDIATE")
+        sess = db.execute(
+            """
+            UPDATE sessions
+               SET ended_at = CASE
+                     WHEN ? > 0 THEN COALESCE(
+                         strftime('%Y-%m-%dT%H:%M:%S', started_at, ?),
+                         strftime('%Y-%m-%dT%H:%M:%S', 'now', ?)
+                     )
+                     ELSE COALESCE(ended_at, ?)
+                   END
+             WHERE id = ?
+            RETURNING plan_id
+            """,
+            (mins, duration, duration, _utcnow_iso(), session_id),
+        ).fetchone()
+        if not sess:
+            abort(404)
 
-    _update_plan_defaults_from_session(db, sess["plan_id"], session_id)
+        _upsert_entries(db, session_id, rows)
+        _update_plan_notes_from_form(db, sess["plan_id"], rows)
+        _update_plan_defaults_from_session(db, sess["plan_id"], session_id)
 
-    db.commit()
     flash("Training wurde gespeichert", "success")
     return redirect(url_for("index"))
 
@@ -269,10 +354,11 @@ def finish_session(session_id: int):
 def abort_session(session_id: int):
     """Training abbrechen – löscht Session (Entries werden per CASCADE gelöscht)."""
     db = get_db()
-    _ = _load_session(db, session_id)
+    if not _session_exists(db, session_id):
+        abort(404)
 
-    db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-    db.commit()
+    with db:
+        db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
 
     flash("Training abgebrochen.", "info")
     return redirect(url_for("index"))
@@ -1,18 +1,99 @@
+import atexit
 import sqlite3
+import threading
 from pathlib import Path
+from typing import Dict, List
 from flask import current_app, g
 
+# Einstellungen pro Connection für dateibasierte Datenbanken. NORMAL spart im
+# WAL-Modus den fsync pro Commit. journal_mode wird dagegen in der Datei
+# gespeichert und deshalb nur einmal beim Start gesetzt (enable_wal).
+_FILE_PRAGMAS = """
+PRAGMA synchronous = NORMAL;
+PRAGMA busy_timeout = 30000;
+PRAGMA cache_size = -65536;
+PRAGMA temp_store = MEMORY;
+PRAGMA mmap_size = 268435456;
+"""
+
+# Größerer Statement-Cache, damit alle SQL-Strings der Blueprints kompiliert bleiben
+_CACHED_STATEMENTS = 512
+
+def _is_memory(db_path: str) -> bool:
+    return db_path == ":memory:" or db_path.startswith("file::memory:")
+
+def _configure(db: sqlite3.Connection, db_path: str) -> None:
+    """Setzt die PRAGMAs einmal pro geöffneter Connection."""
+    db.execute("PRAGMA foreign_keys = ON")
+    if _is_memory(db_path):
+        return
+    db.executescript(_FILE_PRAGMAS)
+
+def enable_wal(db_path: str) -> None:
+    """Schaltet die Datenbank beim App-Start einmalig auf WAL (bleibt gespeichert)."""
+    if _is_memory(db_path) or not Path(db_path).exists():
+        # Noch nicht initialisiert -> init_db.py legt die Datei an
+        return
+    with sqlite3.connect(db_path) as db:
+        db.execute("PRAGMA journal_mode = WAL")
+    db.close()
+
+# Connection-Pool: Connections werden am Request-Ende zurückgegeben und vom
+# nächsten Request wiederverwendet – unabhängig davon, ob der Server pro Request
+# einen neuen Thread startet (app.run) oder feste Worker-Threads hat. Jede
+# Connection gehört immer nur einem Request gleichzeitig.
+_MAX_IDLE_CONNECTIONS = 8
+_pool_lock = threading.Lock()
+_idle: Dict[str, List[sqlite3.Connection]] = {}
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    # check_same_thread=False, da eine Connection nacheinander von
+    # verschiedenen Request-Threads benutzt wird (nie gleichzeitig)
+    db = sqlite3.connect(
+        db_path,
+        cached_statements=_CACHED_STATEMENTS,
+        check_same_thread=False,
+    )
+    db.row_factory = sqlite3.Row
+    _configure(db, db_path)
+    return db
+
+def _acquire(db_path: str) -> sqlite3.Connection:
+    """Freie Connection aus dem Pool oder eine neue."""
+    with _pool_lock:
+        idle = _idle.get(db_path)
+        if idle:
+            return idle.pop()
+    return _connect(db_path)
+
+def _release(db_path: str, db: sqlite3.Connection) -> None:
+    """Connection zurück in den Pool (offene Transaktion wird verworfen)."""
+    if db.in_transaction:
+        db.rollback()
+    with _pool_lock:
+        idle = _idle.setdefault(db_path, [])
+        if len(idle) < _MAX_IDLE_CONNECTIONS:
+            idle.append(db)
+            return
+    db.close()
+
+@atexit.register
+def _close_pool() -> None:
+    with _pool_lock:
+        for idle in _idle.values():
+            for db in idle:
+                db.close()
+        _idle.clear()
+
 def get_db() -> sqlite3.Connection:
-    """Liefert eine (pro Request gecachte) DB-Connection."""
+    """Liefert die DB-Connection des Requests (aus dem Pool)."""
     if "db" not in g:
-        db_path = Path(current_app.instance_path) / "fitlog.db"
-        g.db = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
-        g.db.row_factory = sqlite3.Row
-        g.db.execute("PRAGMA foreign_keys = ON")
+        g.db_path = current_app.config["DB_PATH"]
+        g.db = _acquire(g.db_path)
     return g.db
 
 def close_db(e: Exception | None = None) -> None:
-    """Schließt die DB-Connection am Ende des Requests."""
+    """Gibt die Connection am Ende des Requests an den Pool zurück."""
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        _release(g.pop("db_path"), db)
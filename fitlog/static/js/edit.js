@@ -64,7 +64,7 @@
     const res = await fetch(removeUrl, {
       method: "POST",
       headers: { "Content-Type": "application/x-www-form-urlencoded" },
-      body: new URLSearchParams({ exercise_id: exId }),
+      body: new URLSearchParams([["exercise_id[]", exId]]),
     });
 
     if (res.ok) location.reload();
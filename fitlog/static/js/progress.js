@@ -75,11 +75,11 @@
       if (diagramType === "plan") {
         const pid = planSelect ? planSelect.value : "";
         if (!pid || !planPngTemplate) return;
-        window.location.href = planPngTemplate.replace("0", pid) + "?download=1";
+        window.location.href = planPngTemplate.replace("0", pid) + "?download=1&dpi=140";
       } else {
         const eid = exerciseSelect ? exerciseSelect.value : "";
         if (!eid || !exercisePngTemplate) return;
-        window.location.href = exercisePngTemplate.replace("0", eid) + "?download=1";
+        window.location.href = exercisePngTemplate.replace("0", eid) + "?download=1&dpi=140";
       }
     });
   }
@@ -1,21 +1,51 @@
 import sqlite3
 from pathlib import Path
 
+# Indizes für die häufigen Abfragen in progress/plans/sessions. IF NOT EXISTS, damit
+# init_db.py auch auf bestehenden Datenbanken erneut ausgeführt werden kann.
+INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS idx_se_ex_session         ON session_entries(exercise_id, session_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_plan_started  ON sessions(plan_id, started_at);
+CREATE INDEX IF NOT EXISTS idx_pe_plan_pos            ON plan_exercises(plan_id, position);
+
+-- Listen sortieren nach name COLLATE NOCASE -> Index in derselben Sortierung
+CREATE INDEX IF NOT EXISTS idx_exercises_name_nocase  ON exercises(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_plans_active_name_nocase
+    ON training_plans(name COLLATE NOCASE) WHERE deleted_at IS NULL;
+"""
+
 def init_db():
-    """Initialisiert die SQLite-Datenbank mit der SQL-Datei 001_init.sql."""
+    """
+    Initialisiert die SQLite-Datenbank mit der SQL-Datei 001_init.sql.
+
+    Die SQL-Datei läuft unverändert (eigene BEGIN/COMMIT oder PRAGMAs darin
+    funktionieren wie geschrieben); nur die Indizes laufen in einer Transaktion.
+    """
     db_path = Path("instance/fitlog.db")
     sql_path = Path("instance/init_db.sql")
 
     print(f'Datenbank wird unter "{db_path.resolve()}" initialisiert.')
 
-    with sqlite3.connect(db_path) as connection:
-        with open(sql_path, "r", encoding="utf-8") as f:
-            sql_script = f.read()
+    sql_script = sql_path.read_text(encoding="utf-8")
+
+    connection = sqlite3.connect(db_path)
+    try:
+        # Für das einmalige Anlegen: Journal im RAM, kein fsync
+        connection.execute("PRAGMA journal_mode = MEMORY")
+        connection.execute("PRAGMA synchronous = OFF")
         try:
             connection.executescript(sql_script)
-            connection.commit()
+            connection.executescript("BEGIN;\n" + INDEXES_SQL + "\nCOMMIT;")
         except sqlite3.OperationalError as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
             print(f"Fehler beim Initialisieren der Datenbank: {e}")
+            return
+
+        # Betrieb der App läuft im WAL-Modus (wird in der Datei gespeichert)
+        connection.execute("PRAGMA journal_mode = WAL")
+    finally:
+        connection.close()
 
     print("Datenbank wurde erfolgreich erstellt und initialisiert.")
 
@@ -40,18 +40,19 @@ PLANS = ["Oberkörper", "Beine", "Ganzkörper"]
 def seed_exercises_plans(conn):
     """Fügt typische Übungen in `exercises` ein (idempotent)."""
     conn.execute("PRAGMA foreign_keys = ON;")
-
-    for name in EXERCISES:
-        conn.execute(
-            "INSERT OR IGNORE INTO exercises (name) VALUES (?)",
-            (name,),
-        )
-
-    for plan in PLANS:
-        conn.execute(
-            "INSERT OR IGNORE INTO training_plans (name) VALUES (?)",
-            (plan,),
-        )
+    # Seed-Daten lassen sich jederzeit neu einspielen -> kein fsync nötig
+    conn.execute("PRAGMA synchronous = OFF;")
+
+    # Alle Inserts in einer Transaktion (commit durch den Aufrufer)
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT OR IGNORE INTO exercises (name) VALUES (?)",
+        [(name,) for name in EXERCISES],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO training_plans (name) VALUES (?)",
+        [(plan,) for plan in PLANS],
+    )
 
     count_exercises = conn.execute("SELECT COUNT(*) FROM exercises").fetchone()[0]
     count_plans = conn.execute("SELECT COUNT(*) FROM training_plans").fetchone()[0]
@@ -72,6 +73,8 @@ def main() -> None:
     try:
         seed_exercises_plans(conn)
         conn.commit()
+        # Statistiken für den Query-Planer (Indizes aus init_db.py)
+        conn.execute("ANALYZE")
         print("Seeding abgeschlossen.")
     finally:
         conn.close()
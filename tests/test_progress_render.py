@@ -0,0 +1,37 @@
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip("matplotlib")
+pytest.importorskip("PIL")
+pytest.importorskip("numpy")
+
+from fitlog.blueprints import progress
+
+# Ohne lru_cache rendern, damit jeder Aufruf wirklich matplotlib durchläuft
+render_plan = progress._render_plan_png.__wrapped__
+render_exercise = progress._render_exercise_png.__wrapped__
+
+
+def _history(n, scale):
+    start = date(2023, 1, 1)
+    return tuple(((start + timedelta(days=3 * i)).isoformat(), scale * (1 + i % 7)) for i in range(n))
+
+
+def test_exercise_png_does_not_depend_on_previous_render():
+    x = ("Kniebeugen", _history(5, 1.5), 100)
+    # breitere y-Tick-Labels -> andere Ränder als x
+    y = ("Kreuzheben", _history(200, 12345.0), 100)
+
+    first = render_exercise(*x)
+    render_exercise(*y)
+    assert render_exercise(*x) == first
+
+
+def test_plan_png_does_not_depend_on_previous_render():
+    x = ("Push", (("Bankdrücken", 60.0), ("Seitheben", 8.0)), 100)
+    y = ("Beine", (("Beinpresse mit langem Namen", 25000.0),), 150)
+
+    first = render_plan(*x)
+    render_plan(*y)
+    assert render_plan(*x) == first